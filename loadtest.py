@@ -0,0 +1,888 @@
+# Banc de charge de bout en bout pour l'application de signature
+#
+# Le script lance l'application Flask dans un processus séparé (ou cible une instance existante avec --base-url),
+# démarre un faux serveur SMTP local qui capture tous les mails, puis simule des signataires
+# qui suivent le parcours complet : /upload, /define-fields, /sign/<id>/<step>, /fill-field
+# et /finalise-signature. Chaque signataire attend son mail d'invitation et suit le lien reçu.
+#
+# Exemple : python loadtest.py --concurrency 1,4,16 --sessions 40 --signers 3 --fields-per-signer 2 --pages 5 --pdf-kb 2000
+import argparse  # Pour lire les options de la ligne de commande
+import base64  # Pour encoder la signature simulée en base64
+import hashlib  # Pour comparer les PDF finaux sans les garder en mémoire
+import http.client  # Pour intercepter les réponses HTTP tronquées
+import io  # Pour fabriquer les PDF et images en mémoire
+import json  # Pour lire/écrire les données échangées avec l'application
+import math  # Pour le calcul des percentiles
+import os  # Pour gérer les variables d'environnement et les dossiers
+import re  # Pour extraire les liens et données des pages HTML et des mails
+import shutil  # Pour trouver openssl et nettoyer le dossier de travail
+import socket  # Pour trouver un port libre pour l'application
+import socketserver  # Pour le faux serveur SMTP
+import ssl  # Pour accepter STARTTLS comme un vrai serveur SMTP
+import subprocess  # Pour générer le certificat avec openssl et lancer l'application
+import sys  # Pour rediriger les affichages de l'application
+import tempfile  # Pour créer un dossier de travail isolé
+import threading  # Pour faire tourner le serveur SMTP et l'application en parallèle
+import time  # Pour mesurer les latences
+import urllib.error  # Pour récupérer les erreurs HTTP
+import urllib.parse  # Pour encoder les formulaires
+import urllib.request  # Pour envoyer les requêtes HTTP
+import uuid  # Pour générer des identifiants uniques
+from collections import Counter, defaultdict  # Pour compter les requêtes, erreurs et mails
+from concurrent.futures import ThreadPoolExecutor  # Pour simuler plusieurs sessions en même temps
+from email import message_from_bytes, policy  # Pour relire les mails capturés
+from PyPDF2 import PdfReader  # Pour vérifier le contenu du PDF final
+from PyPDF2.errors import PdfReadError  # PDF final tronqué ou corrompu
+from reportlab.lib.pagesizes import A4  # Format des pages du document de test
+from reportlab.lib.utils import ImageReader  # Pour insérer l'image de remplissage
+from reportlab.pdfgen import canvas as pdfcanvas  # Pour générer le document de test
+from PIL import Image, ImageDraw  # Pour dessiner une signature simulée
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIL_DOMAIN = 'loadtest.invalid'
+SENDER_EMAIL = f'expediteur@{MAIL_DOMAIN}'
+INVITE_SUBJECT = 'Signature requise'
+FINAL_SUBJECT = 'Document signé final'
+SIGN_LINK_RE = re.compile(r"/sign/([^/\s]+)/(\d+)")
+FIELDS_RE = re.compile(r"const fields = (.*);")
+PDF_NAME_RE = re.compile(r'"/uploads/([^"]+)"')
+ENDPOINTS = ['upload', 'define-fields', 'sign', 'uploads', 'fill-field', 'sign-verify', 'finalise-signature', 'get-signers']
+
+# --- Faux serveur SMTP qui capture les mails envoyés par send_email et send_pdf_to_all ---
+
+# Gestion d'une connexion SMTP : on accepte EHLO, STARTTLS, AUTH, MAIL, RCPT et DATA
+class SmtpSinkHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+        self.wfile.flush()
+
+    def read_line(self):
+        return self.rfile.readline(65536).decode('utf-8', 'replace').rstrip('\r\n')
+
+    def handle(self):
+        self.reply("220 loadtest SMTP sink")
+        tls = False
+        mail_from, recipients = None, []
+        while True:
+            line = self.rfile.readline(65536)
+            if not line:
+                return
+            command, _, arg = line.decode('utf-8', 'replace').rstrip('\r\n').partition(' ')
+            command = command.upper()
+
+            if command in ('EHLO', 'HELO'):
+                features = ['8BITMIME', 'AUTH PLAIN LOGIN']
+                if self.server.ssl_context and not tls:
+                    features.insert(0, 'STARTTLS')
+                lines = ['loadtest'] + features
+                for feature in lines[:-1]:
+                    self.wfile.write(f"250-{feature}\r\n".encode())
+                self.reply(f"250 {lines[-1]}")
+
+            elif command == 'STARTTLS' and self.server.ssl_context and not tls:
+                # On bascule la connexion en TLS avec le certificat auto-signé
+                self.reply("220 Ready to start TLS")
+                self.request = self.server.ssl_context.wrap_socket(self.request, server_side=True)
+                self.rfile = self.request.makefile('rb')
+                self.wfile = self.request.makefile('wb')
+                tls = True
+                mail_from, recipients = None, []
+
+            elif command == 'AUTH':
+                # Tous les identifiants sont acceptés, on ne fait que suivre le protocole
+                mechanism, _, initial = arg.partition(' ')
+                if mechanism.upper() == 'LOGIN':
+                    self.reply("334 VXNlcm5hbWU6")
+                    self.read_line()
+                    self.reply("334 UGFzc3dvcmQ6")
+                    self.read_line()
+                elif not initial:
+                    self.reply("334 ")
+                    self.read_line()
+                self.reply("235 Authentication successful")
+
+            elif command == 'MAIL':
+                mail_from = extract_address(arg)
+                recipients = []
+                self.reply("250 OK")
+
+            elif command == 'RCPT':
+                recipients.append(extract_address(arg))
+                self.reply("250 OK")
+
+            elif command == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                chunks = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b".\r\n", b".\n"):
+                        break
+                    # On retire le point ajouté devant les lignes qui commencent par un point
+                    if chunk.startswith(b".."):
+                        chunk = chunk[1:]
+                    chunks.append(chunk)
+                self.server.store(mail_from, recipients, b"".join(chunks))
+                mail_from, recipients = None, []
+                self.reply("250 OK: message captured")
+
+            elif command in ('RSET', 'NOOP'):
+                if command == 'RSET':
+                    mail_from, recipients = None, []
+                self.reply("250 OK")
+
+            elif command == 'QUIT':
+                self.reply("221 Bye")
+                return
+
+            else:
+                self.reply("502 Command not implemented")
+
+
+# Serveur SMTP local : chaque mail reçu est conservé et indexé par destinataire ; des pièces jointes
+# on ne garde que la taille et l'empreinte, sauf pour les adresses réservées avec retain_attachment()
+class SmtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host, port, ssl_context=None):
+        super().__init__((host, port), SmtpSinkHandler)
+        self.ssl_context = ssl_context
+        self.condition = threading.Condition()
+        self.messages = []
+        self.by_recipient = defaultdict(list)
+        self.retained = {}
+
+    # On relit le mail reçu et on garde l'essentiel : destinataires, sujet, corps, taille et empreinte des pièces jointes
+    def store(self, mail_from, recipients, raw):
+        msg = message_from_bytes(raw, policy=policy.default)
+        body = msg.get_body(preferencelist=('plain',))
+        contents = [part.get_content() for part in msg.iter_attachments()]
+        mail = {
+            'from': mail_from,
+            'to': [r.lower() for r in recipients],
+            'subject': str(msg.get('Subject', '')),
+            'body': body.get_content() if body is not None else '',
+            'attachments': [(len(c), hashlib.sha256(c).hexdigest()) for c in contents],
+            'received': time.monotonic(),
+        }
+        with self.condition:
+            self.messages.append(mail)
+            for recipient in mail['to']:
+                self.by_recipient[recipient].append(mail)
+                # Première pièce jointe reçue par une adresse réservée, gardée jusqu'à take_attachment()
+                if contents and recipient in self.retained and self.retained[recipient] is None:
+                    self.retained[recipient] = contents[0]
+            self.condition.notify_all()
+
+    # Demande de garder le contenu de la prochaine pièce jointe reçue par cette adresse
+    def retain_attachment(self, recipient):
+        with self.condition:
+            self.retained[recipient.lower()] = None
+
+    # Rend le contenu gardé pour cette adresse (None si aucun) et le libère
+    def take_attachment(self, recipient):
+        with self.condition:
+            return self.retained.pop(recipient.lower(), None)
+
+    # Liste des mails reçus par une adresse, éventuellement filtrés par sujet
+    def mails_for(self, recipient, subject=None):
+        with self.condition:
+            return [m for m in self.by_recipient.get(recipient.lower(), []) if subject is None or m['subject'] == subject]
+
+    # On attend qu'au moins `count` mails soient arrivés pour cette adresse (ou que le délai expire)
+    def wait_for(self, recipient, subject, count=1, timeout=30):
+        def matching():
+            return [m for m in self.by_recipient.get(recipient.lower(), []) if m['subject'] == subject]
+        with self.condition:
+            self.condition.wait_for(lambda: len(matching()) >= count, timeout=timeout)
+            return matching()
+
+    def total(self):
+        with self.condition:
+            return len(self.messages)
+
+
+# On récupère l'adresse entre chevrons dans "MAIL FROM:<...>" ou "RCPT TO:<...>"
+def extract_address(arg):
+    match = re.search(r"<([^>]*)>", arg)
+    return match.group(1) if match else arg.split(':', 1)[-1].strip()
+
+
+# On prépare le contexte TLS du faux serveur (certificat fourni ou auto-signé généré avec openssl)
+def make_tls_context(workdir, cert=None, key=None):
+    if not cert:
+        openssl = shutil.which('openssl')
+        cert = os.path.join(workdir, 'smtp-cert.pem')
+        key = os.path.join(workdir, 'smtp-key.pem')
+        subprocess.run(
+            [openssl, 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key,
+             '-out', cert, '-days', '1', '-subj', '/CN=localhost'],
+            check=True, capture_output=True
+        )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key or cert)
+    return context
+
+# --- Mesures ---
+
+# Regroupe les latences, erreurs et anomalies d'un palier de charge
+class Stats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.requests = Counter()
+        self.errors = Counter()
+        self.error_reasons = Counter()
+        self.anomalies = Counter()
+        self.anomaly_details = []
+        self.session_durations = []
+        self.sessions_ok = 0
+        self.sessions_failed = 0
+
+    def record(self, endpoint, seconds, ok, reason=None):
+        with self.lock:
+            self.requests[endpoint] += 1
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+                self.error_reasons[f"{endpoint}: {reason}"] += 1
+
+    def anomaly(self, kind, detail):
+        with self.lock:
+            self.anomalies[kind] += 1
+            if len(self.anomaly_details) < 20:
+                self.anomaly_details.append(f"[{kind}] {detail}")
+
+    def session_done(self, seconds, ok):
+        with self.lock:
+            if ok:
+                self.sessions_ok += 1
+                self.session_durations.append(seconds)
+            else:
+                self.sessions_failed += 1
+
+
+# Percentile par rang (pas d'interpolation), en millisecondes
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank] * 1000
+
+# --- Client HTTP des signataires simulés ---
+
+class RequestFailed(Exception):
+    pass
+
+
+# Envoie une requête HTTP, mesure sa durée et lève RequestFailed en cas d'erreur
+def http_request(stats, endpoint, method, url, data=None, headers=None, timeout=60):
+    req = urllib.request.Request(url, data=data, headers=headers or {}, method=method)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            status, body = resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+        stats.record(endpoint, time.perf_counter() - start, False, type(e).__name__)
+        raise RequestFailed(f"{endpoint}: {e}")
+    ok = status < 400
+    stats.record(endpoint, time.perf_counter() - start, ok, None if ok else f"HTTP {status}")
+    if not ok:
+        raise RequestFailed(f"{endpoint}: HTTP {status}")
+    return body
+
+
+def post_json(stats, endpoint, url, payload, timeout):
+    body = http_request(stats, endpoint, 'POST', url, json.dumps(payload).encode(),
+                        {'Content-Type': 'application/json'}, timeout)
+    return json.loads(body)
+
+
+# Encode un fichier en multipart/form-data, comme le formulaire d'upload du navigateur
+def encode_multipart(field_name, filename, content, content_type='application/pdf'):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+# Lit les champs injectés dans la page de signature (const fields = [...])
+def parse_sign_page(html):
+    match = FIELDS_RE.search(html)
+    if not match:
+        raise RequestFailed("sign: champs introuvables dans la page")
+    pdf = PDF_NAME_RE.search(html)
+    return json.loads(match.group(1)), pdf.group(1) if pdf else None
+
+# --- Données de test ---
+
+# Génère un document de `pages` pages remplies de texte ; avec `size_kb`, chaque page reçoit
+# en plus une image de bruit (incompressible) pour que le fichier atteigne à peu près cette taille
+def build_pdf(pages, lines_per_page=45, size_kb=0):
+    buffer = io.BytesIO()
+    can = pdfcanvas.Canvas(buffer, pagesize=A4)
+    # reportlab encode les images en ASCII85 (5 octets pour 4), d'où le facteur 4/5
+    side = int((size_kb * 1024 * 4 / 5 / pages / 3) ** 0.5) if size_kb else 0
+    for page in range(pages):
+        if side:
+            noise = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+            can.drawImage(ImageReader(noise), 440, 20, width=120, height=120)
+        can.setFont("Helvetica", 10)
+        for line in range(lines_per_page):
+            can.drawString(40, 800 - line * 17, f"Page {page + 1} - ligne {line + 1} - contrat de test pour le banc de charge")
+        can.showPage()
+    can.save()
+    return buffer.getvalue()
+
+
+# Dessine une signature simulée et la renvoie au format data URL, comme le canvas du navigateur
+def build_signature():
+    image = Image.new("RGBA", (300, 100), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.line([(10, 70), (80, 20), (150, 80), (220, 25), (290, 60)], fill=(0, 0, 0, 255), width=4)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+# Construit les champs d'une session : `per_signer` champs par signataire, répartis sur les pages
+def build_fields(tag, signers, per_signer, pages, field_types, static_fields):
+    fields = []
+    for signer_id in range(signers):
+        email = f"{tag}-signataire{signer_id}@{MAIL_DOMAIN}"
+        for k in range(per_signer):
+            n = len(fields)
+            fields.append({
+                'id': n,
+                'type': field_types[k % len(field_types)],
+                'signer_id': signer_id,
+                'email': email,
+                'x': 60 + 180 * (n % 3),
+                'y': 80 + 50 * ((n // 3) % 14),
+                'page': n % pages,
+                'signed': False,
+            })
+    for i in range(static_fields):
+        fields.append({'id': len(fields), 'type': 'statictext', 'x': 60, 'y': 780 - 20 * i, 'value': f"{tag} mention {i}"})
+    return fields
+
+
+# Valeur saisie par le signataire simulé selon le type de champ
+def field_value(scenario, tag, index, field):
+    if field['type'] == 'signature':
+        return scenario.signature
+    if field['type'] == 'checkbox':
+        return True
+    return f"{tag}-valeur{index}"
+
+# --- Parcours d'une session de signature ---
+
+# Paramètres communs à toutes les sessions d'un même lancement
+class Scenario:
+
+    def __init__(self, args, base_url, sink):
+        self.args = args
+        self.base_url = base_url.rstrip('/')
+        self.sink = sink
+        if args.pdf:
+            # Document réel fourni par l'utilisateur
+            with open(args.pdf, 'rb') as f:
+                self.pdf = f.read()
+            self.pages = len(PdfReader(io.BytesIO(self.pdf)).pages)
+        else:
+            self.pdf = build_pdf(args.pages, size_kb=args.pdf_kb)
+            self.pages = args.pages
+        self.signature = build_signature()
+        self.field_types = [t.strip() for t in args.field_types.split(',') if t.strip()]
+        self.run_id = uuid.uuid4().hex[:6]
+
+    def url(self, path):
+        return self.base_url + path
+
+
+# Un signataire ouvre son lien, remplit ses zones, vérifie qu'elles sont enregistrées et valide
+def sign_turn(scenario, stats, tag, session_id, step):
+    args = scenario.args
+    page = http_request(stats, 'sign', 'GET', scenario.url(f"/sign/{session_id}/{step}"), timeout=args.http_timeout)
+    fields_all, pdf_name = parse_sign_page(page.decode())
+    if args.fetch_pdf and pdf_name:
+        # Le navigateur télécharge le PDF pour l'afficher avec PDF.js
+        http_request(stats, 'uploads', 'GET', scenario.url(f"/uploads/{pdf_name}"), timeout=args.http_timeout)
+
+    current = next(f for f in fields_all if f.get('step', 0) == step and f.get('type') != 'statictext')
+    mine = [(i, f) for i, f in enumerate(fields_all)
+            if f.get('type') != 'statictext' and f.get('signer_id') == current.get('signer_id') and not f.get('signed')]
+    expected = {i: field_value(scenario, tag, i, f) for i, f in mine}
+
+    def fill(i):
+        if args.think_time:
+            time.sleep(args.think_time)
+        post_json(stats, 'fill-field', scenario.url('/fill-field'), {
+            'session_id': session_id,
+            'step': step,
+            'field_index': i,
+            'value': expected[i],
+            'x_px': fields_all[i].get('x'),
+            'y_px': fields_all[i].get('y'),
+            'field_height': fields_all[i].get('h', 40),
+        }, args.http_timeout)
+
+    # Un utilisateur rapide peut valider plusieurs zones avant que les réponses n'arrivent
+    if args.parallel_fills and len(mine) > 1:
+        with ThreadPoolExecutor(max_workers=len(mine)) as pool:
+            list(pool.map(fill, expected))
+    else:
+        for i in expected:
+            fill(i)
+
+    # On recharge la page pour détecter les mises à jour perdues dans la session
+    page = http_request(stats, 'sign-verify', 'GET', scenario.url(f"/sign/{session_id}/{step}"), timeout=args.http_timeout)
+    stored, _ = parse_sign_page(page.decode())
+    for i, value in expected.items():
+        if not stored[i].get('signed') or stored[i].get('value') != value:
+            stats.anomaly('lost_update_session', f"{session_id} champ {i} non enregistré après /fill-field")
+
+    result = post_json(stats, 'finalise-signature', scenario.url('/finalise-signature'), {
+        'session_id': session_id,
+        'message_final': f"{tag} étape {step} validée",
+    }, args.http_timeout)
+    if result.get('status') != 'finalised':
+        stats.anomaly('finalise_' + str(result.get('status')), f"{session_id} étape {step}")
+    return expected
+
+
+# Parcours complet d'une session, du dépôt du PDF jusqu'à la réception du document final
+def run_session(scenario, stats, index):
+    args = scenario.args
+    tag = f"r{scenario.run_id}s{index}"
+    fields = build_fields(tag, args.signers, args.fields_per_signer, scenario.pages, scenario.field_types, args.static_fields)
+    emails = list(dict.fromkeys(f['email'] for f in fields if f.get('email')))
+    registered = []
+    if args.check_pdf:
+        # Seul le PDF final du premier signataire est gardé en mémoire, le temps de la vérification
+        scenario.sink.retain_attachment(emails[0])
+    start = time.perf_counter()
+    try:
+        body, headers = encode_multipart('pdf', 'document.pdf', scenario.pdf)
+        uploaded = json.loads(http_request(stats, 'upload', 'POST', scenario.url('/upload'), body, headers, args.http_timeout))
+
+        form = urllib.parse.urlencode({
+            'fields_json': json.dumps({'pdf': uploaded['filename'], 'fields': fields}),
+            'email_message': '',
+            'nom_demande': f"Banc de charge {tag}",
+        }).encode()
+        http_request(stats, 'define-fields', 'POST', scenario.url('/define-fields'), form,
+                     {'Content-Type': 'application/x-www-form-urlencoded'}, args.http_timeout)
+        registered = emails
+
+        # Chaque signataire attend son mail d'invitation et suit le lien qu'il contient
+        session_id = None
+        texts = []
+        for email in emails:
+            invites = scenario.sink.wait_for(email, INVITE_SUBJECT, timeout=args.mail_timeout)
+            if not invites:
+                stats.anomaly('mail_missing', f"aucune invitation reçue par {email}")
+                raise RequestFailed(f"invitation manquante pour {email}")
+            link = SIGN_LINK_RE.search(invites[-1]['body'])
+            if not link:
+                raise RequestFailed(f"lien de signature absent du mail envoyé à {email}")
+            session_id, step = link.group(1), int(link.group(2))
+            expected = sign_turn(scenario, stats, tag, session_id, step)
+            texts += [v for i, v in expected.items() if fields[i]['type'] == 'text']
+
+        # Tout le monde doit recevoir le PDF final, qui doit contenir toutes les valeurs saisies
+        finals = [scenario.sink.wait_for(email, FINAL_SUBJECT, timeout=args.mail_timeout) for email in emails]
+        if not all(finals):
+            stats.anomaly('mail_missing', f"{session_id} : PDF final non reçu par tous les signataires")
+            raise RequestFailed("PDF final manquant")
+        digests = {tuple(mails[-1]['attachments']) for mails in finals}
+        if len(digests) > 1:
+            stats.anomaly('lost_update_pdf', f"{session_id} : les signataires n'ont pas reçu le même PDF final")
+        if args.check_pdf:
+            check_final_pdf(stats, session_id, scenario.sink.take_attachment(emails[0]), texts, scenario.pages)
+    except Exception as e:
+        # Une erreur dans une session ne doit pas interrompre tout le palier
+        reason = e if isinstance(e, RequestFailed) else f"{type(e).__name__}: {e}"
+        stats.anomaly('session_failed', f"{tag} : {reason}")
+        stats.session_done(time.perf_counter() - start, False)
+        return registered
+    finally:
+        scenario.sink.take_attachment(emails[0])
+    stats.session_done(time.perf_counter() - start, True)
+    return registered
+
+
+# Vérifie que le PDF joint au mail final contient bien chaque texte saisi (sinon une écriture a été perdue)
+def check_final_pdf(stats, session_id, pdf, texts, pages):
+    if pdf is None:
+        stats.anomaly('lost_update_pdf', f"{session_id} : mail final sans pièce jointe")
+        return
+    try:
+        reader = PdfReader(io.BytesIO(pdf))
+        page_count = len(reader.pages)
+        content = "".join(page.extract_text() or '' for page in reader.pages)
+    except PdfReadError as e:
+        # Des écritures concurrentes peuvent laisser un PDF tronqué
+        stats.anomaly('lost_update_pdf', f"{session_id} : PDF final illisible ({e})")
+        return
+    if page_count != pages:
+        stats.anomaly('lost_update_pdf', f"{session_id} : {page_count} pages au lieu de {pages}")
+    for text in texts:
+        if text not in content:
+            stats.anomaly('lost_update_pdf', f"{session_id} : '{text}' absent du PDF final")
+
+# --- Paliers de charge ---
+
+# Lance `sessions` sessions avec `concurrency` sessions simultanées et vérifie les mails et les signataires
+def run_stage(scenario, concurrency, sessions, offset):
+    args = scenario.args
+    stats = Stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        emails = [e for used in pool.map(lambda i: run_session(scenario, stats, offset + i), range(sessions)) for e in used]
+    elapsed = time.perf_counter() - start
+
+    # Comptage des mails : une invitation et un PDF final par signataire, ni plus ni moins
+    mails = Counter()
+    for email in emails:
+        invites = len(scenario.sink.mails_for(email, INVITE_SUBJECT))
+        finals = len(scenario.sink.mails_for(email, FINAL_SUBJECT))
+        mails['invites'] += invites
+        mails['finals'] += finals
+        if invites > 1 or finals > 1:
+            stats.anomaly('duplicate_mail', f"{email} : {invites} invitation(s), {finals} PDF final(aux)")
+
+    # Le registre signers.json est réécrit à chaque session : aucune adresse ne doit disparaître
+    try:
+        known = set(json.loads(http_request(stats, 'get-signers', 'GET', scenario.url('/get-signers'), timeout=args.http_timeout)))
+        for email in emails:
+            if email.lower() not in known:
+                stats.anomaly('lost_update_signers', f"{email} absent de /get-signers")
+    except RequestFailed as e:
+        stats.anomaly('get_signers_failed', str(e))
+
+    return {
+        'concurrency': concurrency,
+        'sessions': sessions,
+        'elapsed': elapsed,
+        'stats': stats,
+        'mails': mails,
+        'expected_mails': len(emails),
+    }
+
+
+# Résumé chiffré d'un palier (utilisé pour l'affichage et l'export JSON)
+def summarize(stage):
+    stats = stage['stats']
+    total_requests = sum(stats.requests.values())
+    total_errors = sum(stats.errors.values())
+    flow = [v for endpoint, values in stats.latencies.items() if endpoint != 'get-signers' for v in values]
+    return {
+        'concurrency': stage['concurrency'],
+        'sessions': stage['sessions'],
+        'sessions_ok': stats.sessions_ok,
+        'sessions_failed': stats.sessions_failed,
+        'elapsed_s': round(stage['elapsed'], 3),
+        'sessions_per_s': round(stats.sessions_ok / stage['elapsed'], 3) if stage['elapsed'] else 0,
+        'requests': total_requests,
+        'requests_per_s': round(total_requests / stage['elapsed'], 2) if stage['elapsed'] else 0,
+        'error_rate': round(total_errors / total_requests, 4) if total_requests else 0,
+        'p50_ms': round(percentile(flow, 50), 1),
+        'p95_ms': round(percentile(flow, 95), 1),
+        'p99_ms': round(percentile(flow, 99), 1),
+        'session_p95_ms': round(percentile(stats.session_durations, 95), 1),
+        'endpoints': {
+            endpoint: {
+                'count': stats.requests[endpoint],
+                'errors': stats.errors[endpoint],
+                'p50_ms': round(percentile(stats.latencies[endpoint], 50), 1),
+                'p90_ms': round(percentile(stats.latencies[endpoint], 90), 1),
+                'p95_ms': round(percentile(stats.latencies[endpoint], 95), 1),
+                'p99_ms': round(percentile(stats.latencies[endpoint], 99), 1),
+                'max_ms': round(max(stats.latencies[endpoint], default=0) * 1000, 1),
+            }
+            for endpoint in ENDPOINTS if stats.requests[endpoint]
+        },
+        'mails': {
+            'invites': stage['mails']['invites'],
+            'finals': stage['mails']['finals'],
+            'expected_each': stage['expected_mails'],
+        },
+        'anomalies': dict(stats.anomalies),
+        'anomaly_details': stats.anomaly_details,
+        'error_reasons': dict(stats.error_reasons),
+    }
+
+
+# Affiche le détail d'un palier
+def print_stage(summary, out):
+    print(f"\n== Palier : {summary['concurrency']} session(s) simultanée(s), {summary['sessions']} session(s) ==", file=out)
+    print(f"Durée {summary['elapsed_s']:.2f} s | sessions OK {summary['sessions_ok']}/{summary['sessions']} "
+          f"({summary['sessions_per_s']:.2f}/s) | requêtes {summary['requests']} ({summary['requests_per_s']:.1f}/s) "
+          f"| erreurs {summary['error_rate'] * 100:.2f} % | session p95 {summary['session_p95_ms']:.0f} ms", file=out)
+    print(f"{'endpoint':<20}{'n':>6}{'err':>6}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)", file=out)
+    for endpoint, e in summary['endpoints'].items():
+        print(f"{endpoint:<20}{e['count']:>6}{e['errors']:>6}{e['p50_ms']:>9.1f}{e['p90_ms']:>9.1f}"
+              f"{e['p95_ms']:>9.1f}{e['p99_ms']:>9.1f}{e['max_ms']:>9.1f}", file=out)
+    mails = summary['mails']
+    print(f"Mails : invitations {mails['invites']}/{mails['expected_each']}, PDF finaux {mails['finals']}/{mails['expected_each']}", file=out)
+    anomalies = summary['anomalies']
+    lost = {k: v for k, v in anomalies.items() if k.startswith('lost_update')}
+    print(f"Mises à jour perdues : {sum(lost.values())} {lost or ''}".rstrip(), file=out)
+    others = {k: v for k, v in anomalies.items() if not k.startswith('lost_update')}
+    if others:
+        print(f"Autres anomalies : {others}", file=out)
+    for reason, count in summary['error_reasons'].items():
+        print(f"  erreur {reason} x{count}", file=out)
+    for detail in summary['anomaly_details'][:10]:
+        print(f"  {detail}", file=out)
+
+
+# Tableau récapitulatif : on signale le premier palier où la latence ou les erreurs dépassent le budget
+def print_summary(summaries, args, out):
+    print("\n== Récapitulatif ==", file=out)
+    print(f"{'simult.':>8}{'sess/s':>9}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err %':>8}{'pertes':>8}", file=out)
+    collapse = None
+    for s in summaries:
+        lost = sum(v for k, v in s['anomalies'].items() if k.startswith('lost_update'))
+        print(f"{s['concurrency']:>8}{s['sessions_per_s']:>9.2f}{s['requests_per_s']:>9.1f}{s['p50_ms']:>9.1f}"
+              f"{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['error_rate'] * 100:>8.2f}{lost:>8}", file=out)
+        if collapse is None and (s['p95_ms'] > args.p95_budget_ms or s['error_rate'] > args.max_error_rate):
+            collapse = s['concurrency']
+    if collapse is None:
+        print(f"Aucun palier ne dépasse le budget (p95 {args.p95_budget_ms} ms, erreurs {args.max_error_rate * 100:.1f} %).", file=out)
+    else:
+        print(f"Budget dépassé à partir de {collapse} session(s) simultanée(s) "
+              f"(p95 {args.p95_budget_ms} ms, erreurs {args.max_error_rate * 100:.1f} %).", file=out)
+
+# --- Lancement ---
+
+# Variables d'environnement qui branchent l'application sur le faux SMTP
+def app_environment(smtp_host, smtp_port):
+    return {
+        'SMTP_SERVER': smtp_host,
+        'SMTP_PORT': str(smtp_port),
+        'SMTP_USER': SENDER_EMAIL,
+        'SMTP_PASS': 'loadtest',
+    }
+
+
+# Demande un port libre au système
+def free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+# Lance `python app.py` dans un processus séparé, comme le Procfile, depuis une copie du code
+# dans le dossier de travail : les dossiers relatifs (uploads/, sessions/...) y sont créés
+def launch_app(host, port, smtp_host, smtp_port, workdir, log_file, startup_timeout=30):
+    shutil.copy(os.path.join(REPO_DIR, 'app.py'), workdir)
+    shutil.copytree(os.path.join(REPO_DIR, 'templates'), os.path.join(workdir, 'templates'), dirs_exist_ok=True)
+    port = port or free_port(host)
+    base_url = f"http://{host}:{port}"
+    env = dict(os.environ, PORT=str(port), APP_URL=base_url, PYTHONUNBUFFERED='1', **app_environment(smtp_host, smtp_port))
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+    # On attend que l'application réponde avant de lancer la charge
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"l'application s'est arrêtée au démarrage (code {process.returncode})")
+        try:
+            with urllib.request.urlopen(base_url + '/get-signers', timeout=1):
+                return process, base_url
+        except (urllib.error.URLError, http.client.HTTPException, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"l'application ne répond pas après {startup_timeout} s")
+
+
+# Démarre l'application Flask dans ce processus (option --in-process), dans le dossier de travail
+def start_app(host, port, smtp_host, smtp_port, workdir, log_file):
+    from werkzeug.serving import make_server
+    import logging
+
+    os.environ.update(app_environment(smtp_host, smtp_port))
+    sys.path.insert(0, REPO_DIR)
+    import app as signature_app
+
+    # Chemins absolus : send_from_directory résout les chemins relatifs depuis le dossier du code
+    for name in ('UPLOAD_FOLDER', 'SESSION_FOLDER', 'TEMPLATES_FOLDER', 'LOG_FOLDER', 'SIGNERS_FILE'):
+        setattr(signature_app, name, os.path.join(workdir, getattr(signature_app, name)))
+
+    # Les erreurs de l'application vont dans app.log pour ne pas noyer le rapport
+    handler = logging.StreamHandler(log_file)
+    signature_app.app.logger.handlers = [handler]
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = make_server(host, port, signature_app.app, threaded=True)
+    base_url = f"http://{host}:{server.server_port}"
+    os.environ['APP_URL'] = base_url
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Banc de charge de bout en bout de l'application de signature")
+    parser.add_argument('--concurrency', default='1,2,4,8', help="Paliers de sessions simultanées, séparés par des virgules")
+    parser.add_argument('--sessions', type=int, default=20, help="Nombre de sessions par palier")
+    parser.add_argument('--signers', type=int, default=2, help="Signataires par session")
+    parser.add_argument('--fields-per-signer', type=int, default=3, help="Champs à remplir par signataire")
+    parser.add_argument('--field-types', default='text,checkbox,signature', help="Types de champs utilisés à tour de rôle")
+    parser.add_argument('--static-fields', type=int, default=1, help="Textes statiques par session")
+    parser.add_argument('--pages', type=int, default=3, help="Nombre de pages du document")
+    parser.add_argument('--pdf-kb', type=int, default=0, help="Taille visée du document en Ko (image de remplissage sur chaque page)")
+    parser.add_argument('--pdf', help="Utilise ce PDF au lieu d'un document généré (--pages et --pdf-kb sont ignorés)")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Pause (s) avant chaque champ rempli")
+    parser.add_argument('--parallel-fills', action='store_true', help="Envoie les champs d'un signataire en parallèle")
+    parser.add_argument('--no-fetch-pdf', dest='fetch_pdf', action='store_false', help="Ne télécharge pas le PDF sur la page de signature")
+    parser.add_argument('--no-check-pdf', dest='check_pdf', action='store_false', help="Ne vérifie pas le contenu du PDF final")
+    parser.add_argument('--base-url', help="Instance à tester (sinon l'application est lancée dans un processus séparé)")
+    parser.add_argument('--in-process', action='store_true',
+                        help="Lance l'application dans le processus du banc (le banc consomme alors le même CPU)")
+    parser.add_argument('--host', default='127.0.0.1', help="Adresse d'écoute de l'application et du faux SMTP")
+    parser.add_argument('--app-port', type=int, default=0, help="Port de l'application lancée localement (0 = libre)")
+    parser.add_argument('--smtp-port', type=int, default=None, help="Port du faux SMTP (0 = libre, 2525 avec --base-url)")
+    parser.add_argument('--smtp-cert', help="Certificat PEM pour STARTTLS (sinon auto-signé via openssl)")
+    parser.add_argument('--smtp-key', help="Clé PEM associée à --smtp-cert (uniquement avec --smtp-cert)")
+    parser.add_argument('--workdir', help="Dossier de travail de l'application (sinon dossier temporaire)")
+    parser.add_argument('--keep-workdir', action='store_true',
+                        help="Conserve le dossier de travail temporaire (toujours conservé en cas d'erreur ou d'anomalie)")
+    parser.add_argument('--http-timeout', type=float, default=60, help="Délai maximum d'une requête HTTP (s)")
+    parser.add_argument('--mail-timeout', type=float, default=30, help="Délai maximum d'attente d'un mail (s)")
+    parser.add_argument('--p95-budget-ms', type=float, default=1000, help="Latence p95 au-delà de laquelle on considère l'effondrement")
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help="Taux d'erreur maximum accepté")
+    parser.add_argument('--json', dest='json_out', help="Écrit les résultats au format JSON dans ce fichier")
+    args = parser.parse_args(argv)
+    if args.smtp_key and not args.smtp_cert:
+        parser.error("--smtp-key doit être utilisé avec --smtp-cert")
+
+    # Valeurs numériques : une session sans signataire ou un document sans page n'a pas de sens
+    try:
+        args.levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    except ValueError:
+        parser.error("--concurrency attend des entiers séparés par des virgules")
+    if not args.levels or min(args.levels) < 1:
+        parser.error("--concurrency : chaque palier doit valoir au moins 1")
+    for option in ('sessions', 'signers', 'fields_per_signer', 'pages'):
+        if getattr(args, option) < 1:
+            parser.error(f"--{option.replace('_', '-')} doit valoir au moins 1")
+    for option in ('static_fields', 'pdf_kb', 'think_time'):
+        if getattr(args, option) < 0:
+            parser.error(f"--{option.replace('_', '-')} ne peut pas être négatif")
+    if not [t for t in args.field_types.split(',') if t.strip()]:
+        parser.error("--field-types ne peut pas être vide")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    out = sys.stdout
+
+    # Sans STARTTLS, chaque send_email échoue et chaque signataire attendrait --mail-timeout pour rien
+    if not args.smtp_cert and not shutil.which('openssl'):
+        print("[ERROR] openssl introuvable : impossible de générer le certificat du faux SMTP. "
+              "Installez openssl ou passez --smtp-cert/--smtp-key.", file=sys.stderr)
+        return 2
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='signature-loadtest-'))
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+
+    sink = None
+    server = None
+    process = None
+    app_log = None
+    summaries = []
+    pdf_bytes = 0
+    completed = False
+    try:
+        smtp_port = args.smtp_port if args.smtp_port is not None else (2525 if args.base_url else 0)
+        tls = make_tls_context(workdir, args.smtp_cert, args.smtp_key)
+        sink = SmtpSink(args.host, smtp_port, tls)
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        smtp_port = sink.server_address[1]
+
+        if args.base_url:
+            base_url = args.base_url
+            print(f"Faux SMTP sur {args.host}:{smtp_port} : l'instance doit utiliser SMTP_SERVER={args.host} SMTP_PORT={smtp_port}", file=out)
+        elif args.in_process:
+            # Les print() de l'application vont dans un fichier pour ne pas noyer le rapport
+            os.chdir(workdir)
+            app_log = open(os.path.join(workdir, 'app.log'), 'a')
+            server, base_url = start_app(args.host, args.app_port, args.host, smtp_port, workdir, app_log)
+            sys.stdout = app_log
+        else:
+            app_log = open(os.path.join(workdir, 'app.log'), 'a')
+            process, base_url = launch_app(args.host, args.app_port, args.host, smtp_port, workdir, app_log)
+        print(f"Application : {base_url} | dossier de travail : {workdir}", file=out)
+
+        scenario = Scenario(args, base_url, sink)
+        pdf_bytes = len(scenario.pdf)
+        print(f"Document de test : {scenario.pages} page(s), {len(scenario.pdf) / 1024:.0f} Ko ; "
+              f"{args.signers} signataire(s) x {args.fields_per_signer} champ(s)", file=out)
+
+        offset = 0
+        for level in args.levels:
+            summary = summarize(run_stage(scenario, level, args.sessions, offset))
+            offset += args.sessions
+            summaries.append(summary)
+            print_stage(summary, out)
+        print_summary(summaries, args, out)
+        print(f"Mails capturés au total : {sink.total()}", file=out)
+        completed = True
+    except subprocess.CalledProcessError as e:
+        print(f"[ERROR] échec de la génération du certificat par openssl : {e.stderr.decode(errors='replace').strip()}", file=sys.stderr)
+        return 2
+    except (RuntimeError, OSError) as e:
+        # Application qui ne démarre pas, port SMTP occupé, certificat illisible...
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 2
+    finally:
+        sys.stdout = out
+        if server:
+            server.shutdown()
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                # L'application ne s'arrête pas proprement : on la tue pour pouvoir finir le rapport
+                process.kill()
+                process.wait()
+        if app_log:
+            app_log.close()
+        if sink:
+            sink.shutdown()
+            sink.server_close()
+        os.chdir(cwd)
+        # On garde le dossier (et app.log, qui contient les traces des erreurs 500) dès qu'un problème a été vu
+        problems = not completed or any(s['error_reasons'] or s['anomalies'] for s in summaries)
+        if args.workdir or args.keep_workdir or problems:
+            log_path = os.path.join(workdir, 'app.log')
+            if problems and os.path.exists(log_path):
+                print(f"Journal de l'application conservé : {log_path}", file=out)
+            elif problems:
+                print(f"Dossier de travail conservé : {workdir}", file=out)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json_out:
+        with open(args.json_out, 'w') as f:
+            json.dump({'args': vars(args), 'pdf_bytes': pdf_bytes, 'stages': summaries}, f, indent=2, ensure_ascii=False)
+
+    failed = any(s['sessions_failed'] or any(k.startswith('lost_update') for k in s['anomalies']) for s in summaries)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())